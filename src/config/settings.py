@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -10,6 +11,26 @@ class Settings(BaseSettings):
     DB_HOST: str = os.getenv("DB_HOST")
     DB_PORT: str = os.getenv("DB_PORT")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
+    PROFILING_TOKEN: Optional[str] = os.getenv("PROFILING_TOKEN")
+    PROFILES_DIR: str = os.getenv("PROFILES_DIR", "profiles")
+    PROFILES_MAX_FILES: int = int(os.getenv("PROFILES_MAX_FILES", "100"))
+    BERTSCORE_REF_CACHE_SIZE: int = int(os.getenv("BERTSCORE_REF_CACHE_SIZE", "1024"))
+    BERTSCORE_REF_CACHE_MAX_MB: float = float(
+        os.getenv("BERTSCORE_REF_CACHE_MAX_MB", "512")
+    )
+    BERTSCORE_REF_CACHE_DIR: Optional[str] = os.getenv("BERTSCORE_REF_CACHE_DIR")
+    BERTSCORE_WINDOW_TOKENS: Optional[int] = os.getenv("BERTSCORE_WINDOW_TOKENS")
+    OPENAI_JUDGE_MODEL: str = os.getenv("OPENAI_JUDGE_MODEL", "gpt-4o-mini")
+    PROMETHEUS_JUDGE_MODEL: str = os.getenv(
+        "PROMETHEUS_JUDGE_MODEL", "ollama/llama3.2:3b"
+    )
+    PROMETHEUS_TOKENIZER: str = os.getenv(
+        "PROMETHEUS_TOKENIZER", "Xenova/llama-3-tokenizer"
+    )
+    MAX_LLM_INPUT_TOKENS: int = int(os.getenv("MAX_LLM_INPUT_TOKENS", "2048"))
+    LONG_ANSWER_POLICY: str = os.getenv("LONG_ANSWER_POLICY", "truncate")
+    REQUEST_TOKEN_BUDGET: Optional[int] = os.getenv("REQUEST_TOKEN_BUDGET")
+    REQUEST_MEMORY_BUDGET_MB: Optional[float] = os.getenv("REQUEST_MEMORY_BUDGET_MB")
     PROD: bool = False
 
     class Config:
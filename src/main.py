@@ -8,6 +8,7 @@ from src.routers.model_info_router import router as model_info_router
 from src.routers.delete_router import router as delete_router
 from src.routers.count_responses_router import router as count_responses_router
 from src.routers.teacher_evaluation_router import router as teacher_eval_router
+from src.routers.profiling_router import router as profiling_router
 from src.config.db_config import engine, Base
 
 
@@ -24,6 +25,7 @@ app.include_router(
     count_responses_router, prefix="/count-responses", tags=["CountResponses"]
 )
 app.include_router(teacher_eval_router, prefix="/api", tags=["Teacher Evaluation"])
+app.include_router(profiling_router, prefix="/profiling", tags=["Profiling"])
 
 
 app.add_middleware(
@@ -1,26 +1,51 @@
 # src/routers/evaluator_router.py
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, Response
 from src.schemas.evaluation_schemas import EvaluationRequest, EvaluationResponse
 from src.services.evaluation_services import evaluate_all
-from typing import List
+from src.services.profiling_services import request_profiler
+from src.services.length_services import check_request_budget
+import json
+from typing import List, Optional
 
 router = APIRouter()
 
 
 @router.post("/evaluate", response_model=List[EvaluationResponse])
-def evaluate_endpoint(request: EvaluationRequest):
+def evaluate_endpoint(
+    request: EvaluationRequest,
+    response: Response,
+    x_profile_token: Optional[str] = Header(None),
+):
     """
     Endpoint para evaluar las respuestas de un modelo (POST).
+
+    Si se envía el encabezado `X-Profile-Token` con el token de perfilado configurado, la
+    evaluación se perfila y la respuesta incluye los encabezados `X-Profile-Id` y `X-Profile-Stages`.
+
+    Antes de evaluar se estiman los tokens LLM y la memoria de BERTScore de la petición: si superan
+    los presupuestos configurados se responde 413, y si no la decisión se devuelve en el encabezado
+    `X-Length-Budget`.
     """
-    print("Evaluating model responses...")
-    results = evaluate_all(
-        instruction=request.instruction,
-        model_responses=request.model_responses,
-        reference_responses=request.reference_responses,
-        rubric=request.rubric,
-        models_evaluated=request.models_evaluated,
-        tokens_used=request.tokens_used,
+    budget = check_request_budget(
+        request.model_responses,
+        request.reference_responses,
+        [f"{request.instruction} {' '.join(request.rubric.values())}"]
+        * len(request.model_responses),
+        judges=["openai", "prometheus"],
     )
+    print("Evaluating model responses...")
+    with request_profiler(x_profile_token) as profile:
+        results = evaluate_all(
+            instruction=request.instruction,
+            model_responses=request.model_responses,
+            reference_responses=request.reference_responses,
+            rubric=request.rubric,
+            models_evaluated=request.models_evaluated,
+            tokens_used=request.tokens_used,
+            long_answer_policy=request.long_answer_policy,
+        )
+    response.headers.update(profile.headers)
+    response.headers["X-Length-Budget"] = json.dumps(budget, separators=(",", ":"))
 
     return results
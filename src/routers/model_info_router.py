@@ -1,6 +1,7 @@
 # src/routers/model_info_router.py
 
 from fastapi import APIRouter
+from ..config.settings import settings
 
 router = APIRouter()
 
@@ -14,6 +15,6 @@ def get_model_info():
     # Aquí podrías, por ejemplo, devolver la configuración actual del modelo,
     # el nombre del modelo, versión, etc.
     return {
-        "model_name": "ollama/llama3.2:3b",
+        "model_name": settings.PROMETHEUS_JUDGE_MODEL,
         "description": "Modelo local para evaluaciones con PrometheusEval.",
     }
@@ -0,0 +1,29 @@
+# src/routers/profiling_router.py
+
+import os
+import re
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from ..services.profiling_services import check_profiling_token, profile_path
+
+router = APIRouter()
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """
+    Descarga el perfil speedscope (https://www.speedscope.app) de una petición perfilada (GET).
+
+    Requiere el mismo encabezado `X-Profile-Token` usado para perfilar la petición.
+    """
+    check_profiling_token(x_profile_token)
+    if not re.fullmatch(r"[0-9a-f]{32}", profile_id) or not os.path.exists(
+        profile_path(profile_id)
+    ):
+        raise HTTPException(status_code=404, detail="Perfil no encontrado.")
+    return FileResponse(
+        profile_path(profile_id),
+        media_type="application/json",
+        filename=f"{profile_id}.speedscope.json",
+    )
@@ -1,15 +1,26 @@
-from fastapi import APIRouter, File, UploadFile, Form, Depends
+from fastapi import APIRouter, File, UploadFile, Form, Depends, Header, HTTPException
 from fastapi.responses import StreamingResponse
 import json
-from typing import List
-from ..schemas.teacher_evaluation_schemas import TeacherEvaluationRequest
-from ..services.teacher_evaluation_services import process_teacher_evaluation
+from typing import List, Optional
+from ..schemas.teacher_evaluation_schemas import (
+    TeacherEvaluationRequest,
+    BulkTeacherEvaluationRequest,
+)
+from ..services.teacher_evaluation_services import (
+    process_teacher_evaluation,
+    process_bulk_teacher_evaluation,
+)
+from ..services.profiling_services import request_profiler
 
 router = APIRouter()
 
 
 @router.post("/teacher/evaluate")
-def teacher_evaluate(eval_req: str, file: UploadFile = File(...)):
+def teacher_evaluate(
+    eval_req: str,
+    file: UploadFile = File(...),
+    x_profile_token: Optional[str] = Header(None),
+):
     """
     Endpoint for the teacher to upload an Excel file with student responses and
     evaluation parameters (rubric, reference answers, instructions, evaluated models, and tokens used).
@@ -20,20 +31,76 @@ def teacher_evaluate(eval_req: str, file: UploadFile = File(...)):
         JSON string containing the evaluation parameters.
     file : UploadFile
         Excel file with a 'student_name' column and one column per question.
+    x_profile_token : str, optional
+        Profiling token. When it matches the configured token, the request is profiled and the
+        response includes the 'X-Profile-Id' and 'X-Profile-Stages' headers.
 
     Returns
     -------
     StreamingResponse
         An Excel file with the evaluation results for each student.
     """
-    try:
-        eval_req_jsn = TeacherEvaluationRequest(**json.loads(eval_req))
-        output_excel = process_teacher_evaluation(file.file, eval_req_jsn)
-    except Exception as e:
-        return {"error": f"Error al procesar la evaluación: {e}"}
+    with request_profiler(x_profile_token) as profile:
+        try:
+            eval_req_jsn = TeacherEvaluationRequest(**json.loads(eval_req))
+            output_excel = process_teacher_evaluation(file.file, eval_req_jsn)
+        except HTTPException:
+            # Rechazos por presupuesto (413) y errores de validación conservan su código y detalle
+            raise
+        except Exception as e:
+            return {"error": f"Error al procesar la evaluación: {e}"}
 
     return StreamingResponse(
         output_excel,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=teacher_evaluation.xlsx"},
+        headers={
+            "Content-Disposition": "attachment; filename=teacher_evaluation.xlsx",
+            **profile.headers,
+        },
+    )
+
+
+@router.post("/teacher/evaluate-bulk")
+def teacher_evaluate_bulk(
+    eval_req: str = Form(...),
+    file: UploadFile = File(...),
+    x_profile_token: Optional[str] = Header(None),
+):
+    """
+    Endpoint for coordinators to upload a zip with several Excel files of student responses
+    and grade all of them in a single request.
+
+    Parameters
+    ----------
+    eval_req : str
+        Form field with a JSON `BulkTeacherEvaluationRequest` (sent in the body, since per-sheet
+        parameters for many sheets do not fit in a query string): evaluation parameters per sheet
+        (`per_sheet`, keyed by file name inside the zip) and/or shared by every sheet (`shared`).
+    file : UploadFile
+        Zip file with one Excel file per exam, each with a 'student_name' column and one column per question.
+    x_profile_token : str, optional
+        Profiling token, as in `teacher_evaluate`.
+
+    Returns
+    -------
+    StreamingResponse
+        A zip file with one result workbook per sheet and a combined 'summary.xlsx'.
+    """
+    with request_profiler(x_profile_token) as profile:
+        try:
+            bulk_req_jsn = BulkTeacherEvaluationRequest(**json.loads(eval_req))
+            output_zip = process_bulk_teacher_evaluation(file.file, bulk_req_jsn)
+        except HTTPException:
+            # Rechazos por presupuesto (413) y errores de validación conservan su código y detalle
+            raise
+        except Exception as e:
+            return {"error": f"Error al procesar la evaluación: {e}"}
+
+    return StreamingResponse(
+        output_zip,
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=teacher_evaluation_bulk.zip",
+            **profile.headers,
+        },
     )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict
+from typing import List, Dict, Optional, Literal
 from .openai_schemas import EvaluationOutput
 
 
@@ -43,6 +43,11 @@ class EvaluationRequest(BaseModel):
         ...,
         example=[400, 5, 800],
     )
+    long_answer_policy: Optional[Literal["truncate", "summarize"]] = Field(
+        None,
+        description="Qué hacer con las respuestas que superan el límite de tokens de los jueces LLM: recortarlas o resumirlas. Por defecto se usa la configuración del servidor.",
+        example="truncate",
+    )
 
 
 class BERTScore(BaseModel):
@@ -57,3 +62,4 @@ class EvaluationResponse(BaseModel):
     bertscore: BERTScore
     prometheus_score: dict
     cost: float
+    length_action: str = "none"
@@ -18,3 +18,13 @@ class Evaluations(BaseModel):
 class EvaluationOutput(BaseModel):
     evaluations: Evaluations
     final_score: int
+
+
+class QuestionEvaluation(BaseModel):
+    question: int
+    score: int
+    feedback: str
+
+
+class StudentEvaluationOutput(BaseModel):
+    evaluations: List[QuestionEvaluation]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict
+from typing import List, Dict, Optional, Literal
 
 
 class TeacherEvaluationRequest(BaseModel):
@@ -30,3 +30,31 @@ class TeacherEvaluationRequest(BaseModel):
             "Evalúa la pregunta 3 considerando la relevancia de las medidas propuestas y la coherencia en la respuesta.",
         ],
     )
+    packed_grading: bool = Field(
+        False,
+        description="Si es verdadero, todas las preguntas de un estudiante se califican en una sola llamada estructurada a OpenAI. Si la llamada de un estudiante falla, sus preguntas se califican una a una con el mismo juez.",
+        example=False,
+    )
+    near_duplicate_threshold: Optional[float] = Field(
+        None,
+        ge=0.0,
+        le=1.0,
+        description="Similitud mínima (Jaccard estimada con MinHash) para agrupar respuestas casi duplicadas de una misma pregunta y calificar con el LLM solo un representante por grupo. Si es nulo no se agrupa.",
+        example=0.8,
+    )
+    long_answer_policy: Optional[Literal["truncate", "summarize"]] = Field(
+        None,
+        description="Qué hacer con las respuestas que superan el límite de tokens de los jueces LLM: recortarlas o resumirlas. Por defecto se usa la configuración del servidor.",
+        example="truncate",
+    )
+
+
+class BulkTeacherEvaluationRequest(BaseModel):
+    shared: Optional[TeacherEvaluationRequest] = Field(
+        None,
+        description="Parámetros de evaluación aplicados a todas las hojas que no aparecen en `per_sheet`.",
+    )
+    per_sheet: Dict[str, TeacherEvaluationRequest] = Field(
+        default_factory=dict,
+        description="Parámetros de evaluación por hoja, indexados por el nombre del archivo dentro del zip.",
+    )
@@ -0,0 +1,128 @@
+import random
+import re
+import zlib
+
+# Primo de Mersenne usado para las permutaciones universales de MinHash
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text: str, shingle_size: int) -> set:
+    """
+    Normaliza el texto (minúsculas y espacios colapsados) y retorna el conjunto de shingles
+    de caracteres de longitud `shingle_size`, codificados como enteros de 32 bits.
+    """
+    normalized = re.sub(r"\s+", " ", str(text).lower()).strip()
+    if len(normalized) <= shingle_size:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {
+        zlib.crc32(normalized[i : i + shingle_size].encode("utf-8"))
+        for i in range(len(normalized) - shingle_size + 1)
+    }
+
+
+# Probabilidad mínima de que un par con similitud igual al umbral sea candidato en LSH
+_MIN_CANDIDATE_RECALL = 0.99
+
+
+def _lsh_bands(num_perm: int, threshold: float) -> tuple:
+    """
+    Elige el número de bandas y filas por banda (b * r = num_perm) priorizando la exhaustividad:
+    la configuración con más filas por banda (menos candidatos falsos) en la que un par con
+    similitud igual a `threshold` sea candidato con probabilidad 1 - (1 - t^r)^b de al menos
+    `_MIN_CANDIDATE_RECALL`. Si ninguna la alcanza se usa una fila por banda.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= _MIN_CANDIDATE_RECALL:
+            best = (bands, rows)
+    return best
+
+
+def cluster_answers(
+    answers: list,
+    threshold: float,
+    num_perm: int = 64,
+    shingle_size: int = 5,
+    seed: int = 1,
+) -> list:
+    """
+    Agrupa respuestas casi duplicadas usando MinHash con LSH por bandas.
+
+    Cada respuesta se representa por sus shingles de caracteres. Las respuestas se recorren en
+    orden y cada una se asigna al primer grupo cuyo representante (su primera respuesta) tenga una
+    similitud de Jaccard estimada con MinHash mayor o igual a `threshold`; si no hay ninguno, abre
+    un grupo nuevo del que es representante. Así todo miembro está a `threshold` o más de su
+    representante, sin encadenar similitudes entre miembros. LSH solo se usa para encontrar
+    representantes candidatos, que luego se verifican con la firma completa; las bandas se eligen
+    para que un par con similitud igual al umbral sea candidato con probabilidad >= 99 % (ver
+    `_lsh_bands`), por lo que una pequeña fracción de casi duplicados puede quedar en grupos aparte.
+
+    Parameters
+    ----------
+    answers : list of str
+        Respuestas a agrupar.
+    threshold : float
+        Similitud de Jaccard mínima (entre 0 y 1) con el representante para entrar en su grupo.
+    num_perm : int
+        Número de permutaciones de la firma MinHash.
+    shingle_size : int
+        Longitud en caracteres de cada shingle.
+    seed : int
+        Semilla para las permutaciones, de modo que el agrupamiento sea reproducible.
+
+    Returns
+    -------
+    list of int
+        Identificador de grupo para cada respuesta, en el mismo orden de entrada. Los
+        identificadores se numeran desde 0 en orden de primera aparición, de modo que el
+        representante de cada grupo es su primera respuesta.
+    """
+    if threshold <= 0:
+        return [0] * len(answers)
+
+    rng = random.Random(seed)
+    permutations = [
+        (rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+        for _ in range(num_perm)
+    ]
+
+    bands, rows = _lsh_bands(num_perm, threshold)
+    # Solo se indexan los representantes: cada respuesta se compara con ellos y nunca con otros miembros
+    leader_buckets = {}
+    leaders = []
+    cluster_ids = []
+    for answer in answers:
+        shingles = _shingles(answer, shingle_size)
+        signature = [
+            min(((a * s + b) % _MERSENNE_PRIME) & _MAX_HASH for s in shingles)
+            for a, b in permutations
+        ]
+        band_keys = [
+            (band, tuple(signature[band * rows : (band + 1) * rows]))
+            for band in range(bands)
+        ]
+
+        candidates = sorted(
+            {
+                cluster_id
+                for key in band_keys
+                for cluster_id in leader_buckets.get(key, ())
+            }
+        )
+        for cluster_id in candidates:
+            matches = sum(x == y for x, y in zip(signature, leaders[cluster_id]))
+            if matches / num_perm >= threshold:
+                cluster_ids.append(cluster_id)
+                break
+        else:
+            cluster_id = len(leaders)
+            leaders.append(signature)
+            for key in band_keys:
+                leader_buckets.setdefault(key, []).append(cluster_id)
+            cluster_ids.append(cluster_id)
+
+    return cluster_ids
@@ -0,0 +1,281 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from bert_score import BERTScorer
+from bert_score.utils import bert_encode, greedy_cos_idf, padding
+from ..config.settings import settings
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+# Versión del formato de las entradas en caché; se incrementa si cambia cómo se calculan
+_CACHE_FORMAT_VERSION = 2
+
+
+def get_bertscore_scorer() -> BERTScorer:
+    """
+    Retorna el `BERTScorer` compartido (mismo modelo que `bert_score.score(..., lang="es")`),
+    cargándolo la primera vez que se usa.
+    """
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = BERTScorer(lang="es")
+    return _scorer
+
+
+class ReferenceEmbeddingCache:
+    """
+    Caché de embeddings por token y pesos IDF de textos de referencia para BERTScore.
+
+    Las entradas se indexan por el hash del texto junto con el modelo, la capa, el tamaño de
+    ventana y la versión del formato, para no reutilizar embeddings calculados de otra forma. En memoria
+    se guardan como máximo `max_entries` referencias y `max_bytes` bytes de arrays (LRU): como cada
+    embedding ocupa longitud x dimensión x 4 bytes, el límite en bytes es el que acota la memoria con
+    referencias largas. Si se indica `cache_dir`, además se persisten como archivos .npy que se abren
+    con memory-map, de modo que se comparten entre peticiones y reinicios sin cargarse completas en
+    memoria; esas entradas no cuentan para `max_bytes`.
+
+    Parameters
+    ----------
+    max_entries : int
+        Número máximo de referencias en memoria.
+    max_bytes : int
+        Tamaño máximo en bytes de los embeddings y pesos IDF guardados en memoria.
+    cache_dir : str, optional
+        Directorio del almacenamiento en disco. Si es None solo se usa la caché en memoria.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, cache_dir: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_type: str, num_layers: int, window: int, text: str) -> str:
+        """
+        Clave de una referencia: modelo, capa, tamaño de ventana y versión del formato, más el hash del texto.
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return (
+            f"{model_type.replace('/', '_')}_L{num_layers}_w{window}"
+            f"_v{_CACHE_FORMAT_VERSION}/{digest}"
+        )
+
+    def _paths(self, key: str) -> tuple:
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.emb.npy", f"{base}.idf.npy"
+
+    def get(self, key: str):
+        """
+        Retorna (embedding, idf) como arrays de numpy, o None si la referencia no está en caché.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if self.cache_dir is None:
+            return None
+        emb_path, idf_path = self._paths(key)
+        if not (os.path.exists(emb_path) and os.path.exists(idf_path)):
+            return None
+        entry = (np.load(emb_path, mmap_mode="r"), np.load(idf_path, mmap_mode="r"))
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, embedding: np.ndarray, idf: np.ndarray):
+        """
+        Guarda el embedding por token (longitud x dimensión) y los pesos IDF de una referencia.
+        """
+        self._remember(key, (embedding, idf))
+        if self.cache_dir is None:
+            return
+        emb_path, idf_path = self._paths(key)
+        os.makedirs(os.path.dirname(emb_path), exist_ok=True)
+        # Escritura atómica para que otra petición nunca abra un archivo a medio escribir
+        for path, array in ((idf_path, idf), (emb_path, embedding)):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _entry_bytes(entry: tuple) -> int:
+        # Los arrays con memory-map viven en el disco y no ocupan memoria propia del proceso
+        return sum(0 if isinstance(a, np.memmap) else a.nbytes for a in entry)
+
+    def _remember(self, key: str, entry: tuple):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entry_bytes(self._entries[key])
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._bytes += self._entry_bytes(entry)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._entry_bytes(evicted)
+
+
+reference_embedding_cache = ReferenceEmbeddingCache(
+    settings.BERTSCORE_REF_CACHE_SIZE,
+    int(settings.BERTSCORE_REF_CACHE_MAX_MB * 2**20),
+    settings.BERTSCORE_REF_CACHE_DIR,
+)
+
+
+def _pad_batch_stats(stats: list, device) -> tuple:
+    """
+    Rellena una lista de (embedding, idf) por oración igual que `bert_score.utils.bert_cos_score_idf`.
+    """
+    emb = [torch.as_tensor(np.array(e)).to(device) for e, _ in stats]
+    idf = [torch.as_tensor(np.array(i)).to(device) for _, i in stats]
+    lens = torch.tensor([e.size(0) for e in emb], dtype=torch.long)
+    emb_pad = pad_sequence(emb, batch_first=True, padding_value=2.0)
+    idf_pad = pad_sequence(idf, batch_first=True)
+    base = torch.arange(int(lens.max()), dtype=torch.long).expand(len(lens), -1)
+    pad_mask = (base < lens.unsqueeze(1)).to(device)
+    return emb_pad, pad_mask, idf_pad
+
+
+def _window_size(tokenizer) -> int:
+    """
+    Tokens por ventana: el máximo del codificador (sin [CLS]/[SEP]) salvo que
+    `settings.BERTSCORE_WINDOW_TOKENS` indique un valor menor.
+    """
+    window = tokenizer.model_max_length - 2
+    if settings.BERTSCORE_WINDOW_TOKENS:
+        window = min(window, settings.BERTSCORE_WINDOW_TOKENS)
+    return window
+
+
+def _token_windows(sentence: str, tokenizer, window: int) -> list:
+    """
+    Tokeniza un texto y lo divide en ventanas consecutivas de como máximo `window` tokens, para
+    que el codificador no lo trunque en silencio.
+
+    Las ventanas se forman sobre los ids originales (no se decodifican y vuelven a tokenizar), así
+    que cada subpalabra se codifica tal cual. Un texto que cabe entero produce una sola ventana con
+    los mismos ids que `bert_score.utils.sent_encode`.
+    """
+    ids = tokenizer.encode(sentence.strip(), add_special_tokens=False)
+    chunks = [ids[i : i + window] for i in range(0, len(ids), window)] or [[]]
+    return [tuple(tokenizer.build_inputs_with_special_tokens(c)) for c in chunks]
+
+
+def _embed(sentences: list, scorer: BERTScorer, idf_dict) -> dict:
+    """
+    Calcula el embedding por token y los pesos IDF de cada oración, sin relleno y en CPU.
+
+    Las oraciones largas se codifican por ventanas (ver `_token_windows`) y se concatenan los
+    embeddings de sus ventanas, de modo que el emparejamiento voraz de BERTScore se hace sobre
+    todos los tokens del texto y no solo sobre los primeros.
+    """
+    tokenizer = scorer._tokenizer
+    window = _window_size(tokenizer)
+    windows = {sen: _token_windows(sen, tokenizer, window) for sen in sentences}
+    window_ids = list(dict.fromkeys(w for ws in windows.values() for w in ws))
+
+    window_stats = {}
+    for batch_start in range(0, len(window_ids), scorer.batch_size):
+        id_batch = window_ids[batch_start : batch_start + scorer.batch_size]
+        padded, lens, mask = padding(
+            [list(ids) for ids in id_batch], tokenizer.pad_token_id, dtype=torch.long
+        )
+        padded_idf, _, _ = padding(
+            [[idf_dict[i] for i in ids] for ids in id_batch], 0, dtype=torch.float
+        )
+        embs = bert_encode(
+            scorer._model,
+            padded.to(scorer.device),
+            attention_mask=mask.to(scorer.device),
+        ).cpu()
+        for i, ids in enumerate(id_batch):
+            sequence_len = lens[i].item()
+            window_stats[ids] = (
+                embs[i, :sequence_len].clone().numpy(),
+                padded_idf[i, :sequence_len].clone().numpy(),
+            )
+
+    stats = {}
+    for sen, ws in windows.items():
+        if len(ws) == 1:
+            stats[sen] = window_stats[ws[0]]
+        else:
+            stats[sen] = (
+                np.concatenate([window_stats[w][0] for w in ws]),
+                np.concatenate([window_stats[w][1] for w in ws]),
+            )
+    return stats
+
+
+def score_with_reference_cache(candidates: list, references: list) -> tuple:
+    """
+    Calcula BERTScore (P, R, F1 por par) reutilizando los embeddings de las referencias.
+
+    Equivale a `bert_score.score(candidates, references, lang="es")` sin IDF ni reescalado
+    (salvo que los textos largos se codifican por ventanas en lugar de truncarse), pero los
+    embeddings y pesos IDF de cada referencia única se calculan una sola vez y se guardan en
+    `reference_embedding_cache`; en cada llamada solo se codifican los candidatos.
+
+    Parameters
+    ----------
+    candidates : list of str
+        Respuestas a evaluar.
+    references : list of str
+        Respuestas de referencia, una por candidato.
+
+    Returns
+    -------
+    tuple of torch.Tensor
+        Tensores P, R y F1 con un valor por par (candidato, referencia).
+    """
+    scorer = get_bertscore_scorer()
+    tokenizer = scorer._tokenizer
+    idf_dict = defaultdict(lambda: 1.0)
+    idf_dict[tokenizer.sep_token_id] = 0
+    idf_dict[tokenizer.cls_token_id] = 0
+
+    window = _window_size(tokenizer)
+    ref_stats = {}
+    missing = []
+    for ref in dict.fromkeys(references):
+        key = ReferenceEmbeddingCache.key(
+            scorer.model_type, scorer.num_layers, window, ref
+        )
+        entry = reference_embedding_cache.get(key)
+        if entry is None:
+            missing.append(ref)
+        else:
+            ref_stats[ref] = entry
+    for ref, entry in _embed(missing, scorer, idf_dict).items():
+        key = ReferenceEmbeddingCache.key(
+            scorer.model_type, scorer.num_layers, window, ref
+        )
+        reference_embedding_cache.put(key, *entry)
+        ref_stats[ref] = entry
+
+    hyp_stats = _embed(list(dict.fromkeys(candidates)), scorer, idf_dict)
+
+    device = next(scorer._model.parameters()).device
+    preds = []
+    with torch.no_grad():
+        for batch_start in range(0, len(references), scorer.batch_size):
+            batch_refs = references[batch_start : batch_start + scorer.batch_size]
+            batch_hyps = candidates[batch_start : batch_start + scorer.batch_size]
+            P, R, F1 = greedy_cos_idf(
+                *_pad_batch_stats([ref_stats[r] for r in batch_refs], device),
+                *_pad_batch_stats([hyp_stats[h] for h in batch_hyps], device),
+            )
+            preds.append(torch.stack((P, R, F1), dim=-1).cpu())
+    preds = torch.cat(preds, dim=0)
+    return preds[:, 0], preds[:, 1], preds[:, 2]
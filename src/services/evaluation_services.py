@@ -1,12 +1,14 @@
 import openai
-from bert_score import score
 from prometheus_eval.vllm import VLLM
 from prometheus_eval import PrometheusEval
 from prometheus_eval.prompts import ABSOLUTE_PROMPT, SCORE_RUBRIC_TEMPLATE
 from prometheus_eval.litellm import LiteLLM, AsyncLiteLLM
 from openai import OpenAI
 from ..config.settings import settings
-from ..schemas.openai_schemas import EvaluationOutput
+from ..schemas.openai_schemas import EvaluationOutput, StudentEvaluationOutput
+from .profiling_services import profile_stage
+from .bertscore_cache_services import score_with_reference_cache
+from .length_services import fit_llm_input, count_tokens
 import os
 
 
@@ -93,7 +95,7 @@ def evaluate_with_openai(
 
     try:
         completion = client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
+            model=settings.OPENAI_JUDGE_MODEL,
             messages=[
                 {
                     "role": "developer",
@@ -112,12 +114,102 @@ def evaluate_with_openai(
         return None
 
 
+# Límite de tokens (tokenizador de OpenAI) del prompt empaquetado; por encima se califica pregunta por pregunta.
+PACKED_PROMPT_MAX_TOKENS = 15000
+
+
+def evaluate_student_with_openai(
+    instructions: list, student_answers: list, reference_responses: list, rubric: dict
+) -> StudentEvaluationOutput:
+    """
+    Califica todas las respuestas de un estudiante en una sola llamada estructurada.
+
+    La rúbrica se envía una única vez y las instrucciones, referencias y respuestas se agrupan
+    en orden por pregunta. La salida se valida con `StudentEvaluationOutput` y se comprueba que
+    contenga exactamente una evaluación por pregunta, numeradas desde 1, con puntuaciones de 1 a 5.
+
+    Parameters
+    ----------
+    instructions : list of str
+        Instrucciones de cada pregunta.
+    student_answers : list of str
+        Respuestas del estudiante, en el mismo orden que las instrucciones.
+    reference_responses : list of str
+        Respuestas de referencia de cada pregunta.
+    rubric : dict
+        Diccionario con los criterios y descripciones de la rúbrica (mismo formato que Prometheus).
+
+    Returns
+    -------
+    StudentEvaluationOutput or None
+        Evaluaciones ordenadas por pregunta, o None si el prompt es demasiado largo, la llamada
+        falla o la salida no es válida; en ese caso el llamador debe calificar pregunta por pregunta.
+    """
+    rubric_text = SCORE_RUBRIC_TEMPLATE.format(**rubric)
+    questions_text = "".join(
+        f"### Pregunta {q + 1}\n"
+        f"Instrucción: {instruction}\n"
+        f"Respuesta de referencia: {reference}\n"
+        f"Respuesta del estudiante: {answer}\n\n"
+        for q, (instruction, reference, answer) in enumerate(
+            zip(instructions, reference_responses, student_answers)
+        )
+    )
+    prompt = (
+        f"Rúbrica de calificación:\n{rubric_text}\n\n"
+        f"{questions_text}"
+        "Evalúa cada respuesta del estudiante comparándola con su respuesta de referencia, "
+        "siguiendo la instrucción de la pregunta y la rúbrica anterior.\n"
+        "Para cada pregunta devuelve su número (empezando en 1), una puntuación entera del 1 al 5 "
+        "y una breve retroalimentación. Devuelve las preguntas en el mismo orden.\n"
+    )
+
+    if count_tokens(prompt, "openai") > PACKED_PROMPT_MAX_TOKENS:
+        return None
+
+    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+    try:
+        completion = client.beta.chat.completions.parse(
+            model=settings.OPENAI_JUDGE_MODEL,
+            messages=[
+                {
+                    "role": "developer",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "You are a fair teacher grading an exam.",
+                        }
+                    ],
+                },
+                {"role": "user", "content": [{"type": "text", "text": prompt}]},
+            ],
+            response_format=StudentEvaluationOutput,
+        )
+        structured_output = completion.choices[0].message.parsed
+    except Exception as e:
+        print(f"Error en evaluate_student_with_openai: {e}")
+        return None
+
+    if structured_output is None:
+        return None
+    evaluations = structured_output.evaluations
+    if [e.question for e in evaluations] != list(range(1, len(instructions) + 1)):
+        return None
+    if any(not 1 <= e.score <= 5 for e in evaluations):
+        return None
+    return structured_output
+
+
 def evaluate_with_bertscore(model_responses: list, reference_responses: list) -> dict:
     """
     Evalúa en batch usando BERTScore y retorna los promedios de Precision, Recall y F1.
+
+    Los embeddings de las referencias se reutilizan entre llamadas mediante
+    `score_with_reference_cache`, por lo que solo se codifican las respuestas evaluadas.
     """
     try:
-        P, R, F1 = score(model_responses, reference_responses, lang="es", verbose=True)
+        P, R, F1 = score_with_reference_cache(model_responses, reference_responses)
         bert_results = {
             "precision": P.mean().item(),
             "recall": R.mean().item(),
@@ -135,7 +227,7 @@ def init_prometheus_judge() -> PrometheusEval:
     Inicializa y retorna una instancia del evaluador Prometheus-Eval usando el modelo local.
 
     Esta función crea una instancia del evaluador Prometheus-Eval utilizando un modelo local.
-    Se emplea la clase LiteLLM con el identificador del modelo "ollama/llama3.2:3b", el cual se puede ajustar según sea necesario.
+    Se emplea la clase LiteLLM con el identificador del modelo `settings.PROMETHEUS_JUDGE_MODEL` ("ollama/llama3.2:3b" por defecto), el cual se puede ajustar según sea necesario.
 
     Returns
     -------
@@ -143,7 +235,7 @@ def init_prometheus_judge() -> PrometheusEval:
         Instancia inicializada de PrometheusEval con el modelo local y la plantilla de calificación absoluta definida.
     """
 
-    model = LiteLLM("ollama/llama3.2:3b")
+    model = LiteLLM(settings.PROMETHEUS_JUDGE_MODEL)
     return PrometheusEval(model=model, absolute_grade_template=ABSOLUTE_PROMPT)
 
 
@@ -205,6 +297,7 @@ def evaluate_all(
     rubric: dict,
     models_evaluated: list,
     tokens_used: list,
+    long_answer_policy: str = None,
 ) -> dict:
     """
     Evalúa un conjunto de respuestas del modelo utilizando múltiples métodos de evaluación,
@@ -231,6 +324,9 @@ def evaluate_all(
         Lista de modelos evaluados.
     tokens_used : list of float
         Lista de tokens usados por cada modelo evaluado, en caso de que sea copilot esto será el número de respuestas generativas en un modelo.
+    long_answer_policy : str, optional
+        Política para las respuestas que superan el límite de tokens de los jueces LLM ("truncate" o
+        "summarize"); ver `fit_llm_input`. BERTScore siempre usa la respuesta completa.
 
     Returns
     -------
@@ -243,7 +339,9 @@ def evaluate_all(
                     "model_response": str,
                     "openai_score": EvaluationOutput,
                     "bertscore": {"precision": float, "recall": float, "f1": float},
-                    "prometheus_score": {"feedback": str, "score": int}
+                    "prometheus_score": {"feedback": str, "score": int},
+                    "cost": float,
+                    "length_action": str
                 },
                 ...
             ]
@@ -254,13 +352,20 @@ def evaluate_all(
     for model_resp, ref_resp, model_used, tokens in zip(
         model_responses, reference_responses, models_evaluated, tokens_used
     ):
-        openai_score = evaluate_with_openai(instruction, model_resp, ref_resp)
-
-        feedback, prometheus_score = evaluate_prometheus(
-            instruction, model_resp, ref_resp, rubric
+        judged_resp, length_action = fit_llm_input(
+            model_resp, long_answer_policy, judges=("openai", "prometheus")
         )
 
-        bertscore = evaluate_with_bertscore([model_resp], [ref_resp])
+        with profile_stage("openai"):
+            openai_score = evaluate_with_openai(instruction, judged_resp, ref_resp)
+
+        with profile_stage("prometheus"):
+            feedback, prometheus_score = evaluate_prometheus(
+                instruction, judged_resp, ref_resp, rubric
+            )
+
+        with profile_stage("bertscore"):
+            bertscore = evaluate_with_bertscore([model_resp], [ref_resp])
         cost = calculate_cost(model_used, tokens)
         document_result = {
             "model_response": model_resp,
@@ -268,6 +373,7 @@ def evaluate_all(
             "bertscore": bertscore,
             "prometheus_score": {"feedback": feedback, "score": prometheus_score},
             "cost": cost,
+            "length_action": length_action,
         }
         documents.append(document_result)
 
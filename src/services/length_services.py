@@ -0,0 +1,225 @@
+import threading
+import time
+from fastapi import HTTPException
+from openai import OpenAI
+from ..config.settings import settings
+
+# Tamaño de los embeddings del modelo de BERTScore para "es" (bert-base-multilingual-cased)
+_BERTSCORE_HIDDEN_SIZE = 768
+
+# Funciones de tokenización por juez, cargadas al primer uso
+_token_encoders = {}
+_token_encoders_lock = threading.Lock()
+# Momento del último intento fallido de carga por juez; se reintenta pasado este intervalo
+_token_encoder_failures = {}
+_TOKENIZER_RETRY_SECONDS = 300
+
+
+def _load_token_encoder(judge: str):
+    if judge == "openai":
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("o200k_base")
+        return encoding.encode
+    if judge == "prometheus":
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_pretrained(settings.PROMETHEUS_TOKENIZER)
+        return lambda text: tokenizer.encode(text, add_special_tokens=False).ids
+    if judge == "bertscore":
+        from .bertscore_cache_services import get_bertscore_scorer
+
+        tokenizer = get_bertscore_scorer()._tokenizer
+        return lambda text: tokenizer.encode(text, add_special_tokens=False)
+    raise ValueError(f"Juez desconocido: {judge}")
+
+
+def _get_token_encoder(judge: str):
+    with _token_encoders_lock:
+        if judge in _token_encoders:
+            return _token_encoders[judge]
+        failed_at = _token_encoder_failures.get(judge)
+        if (
+            failed_at is not None
+            and time.monotonic() - failed_at < _TOKENIZER_RETRY_SECONDS
+        ):
+            return None
+        # El tokenizador puede no estar instalado o requerir una descarga (p. ej. sin red): mientras
+        # no se pueda cargar se usa la estimación de ~4 caracteres por token y se reintenta más tarde
+        try:
+            _token_encoders[judge] = _load_token_encoder(judge)
+        except Exception as e:
+            print(f"Error al cargar el tokenizador de {judge}: {e}")
+            _token_encoder_failures[judge] = time.monotonic()
+            return None
+        _token_encoder_failures.pop(judge, None)
+        return _token_encoders[judge]
+
+
+def count_tokens(text: str, judge: str) -> int:
+    """
+    Cuenta los tokens de un texto con el tokenizador del juez indicado.
+
+    Parameters
+    ----------
+    text : str
+        Texto a contar.
+    judge : str
+        "openai" (tiktoken o200k_base), "prometheus" (tokenizador de `settings.PROMETHEUS_TOKENIZER`)
+        o "bertscore" (tokenizador WordPiece del modelo de BERTScore).
+
+    Returns
+    -------
+    int
+        Número de tokens, o una estimación de ~4 caracteres por token si el tokenizador no está
+        disponible (la carga se reintenta cada `_TOKENIZER_RETRY_SECONDS`).
+    """
+    text = str(text)
+    encode = _get_token_encoder(judge)
+    if encode is None:
+        return (len(text) + 3) // 4
+    return len(encode(text))
+
+
+def _truncate(text: str, max_tokens: int, judges: tuple) -> str:
+    # Recorte proporcional en caracteres hasta que el texto quepa para todos los jueces
+    for _ in range(5):
+        tokens = max(count_tokens(text, judge) for judge in judges)
+        if tokens <= max_tokens:
+            break
+        text = text[: int(len(text) * max_tokens / tokens)]
+    return text
+
+
+def _summarize(text: str, max_tokens: int) -> str:
+    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    completion = client.chat.completions.create(
+        model=settings.OPENAI_JUDGE_MODEL,
+        messages=[
+            {
+                "role": "developer",
+                "content": "Resume el texto conservando sus ideas, argumentos y datos principales, "
+                "sin añadir información nueva ni valorarlo. Responde en el idioma del texto.",
+            },
+            {"role": "user", "content": text},
+        ],
+        max_tokens=max_tokens,
+    )
+    return completion.choices[0].message.content
+
+
+def fit_llm_input(
+    text: str, policy: str = None, judges: tuple = ("prometheus",)
+) -> tuple:
+    """
+    Ajusta una respuesta al límite de tokens de entrada de los jueces LLM.
+
+    Parameters
+    ----------
+    text : str
+        Respuesta a evaluar.
+    policy : str, optional
+        "truncate" para recortar la respuesta al límite o "summarize" para resumirla con el LLM
+        (si el resumen falla se recorta). Por defecto `settings.LONG_ANSWER_POLICY`.
+    judges : tuple of str
+        Jueces que recibirán la respuesta ("openai" y/o "prometheus"); el texto debe caber en
+        `settings.MAX_LLM_INPUT_TOKENS` con el tokenizador de cada uno.
+
+    Returns
+    -------
+    tuple
+        (texto a enviar a los jueces, acción aplicada: "none", "truncated" o "summarized")
+    """
+    policy = policy or settings.LONG_ANSWER_POLICY
+    max_tokens = settings.MAX_LLM_INPUT_TOKENS
+    if max(count_tokens(text, judge) for judge in judges) <= max_tokens:
+        return text, "none"
+
+    text = str(text)
+
+    if policy == "summarize":
+        try:
+            summary = _summarize(text, max_tokens)
+            return _truncate(summary, max_tokens, judges), "summarized"
+        except Exception as e:
+            print(f"Error en fit_llm_input: {e}")
+    return _truncate(text, max_tokens, judges), "truncated"
+
+
+def check_request_budget(
+    answers: list, references: list, prompts: list, judges: list
+) -> dict:
+    """
+    Estima los tokens LLM y la memoria de BERTScore de una petición y la rechaza si supera los presupuestos.
+
+    Los tokens se cuentan con el tokenizador de cada juez: el prompt (instrucción y rúbrica) más la
+    referencia y la respuesta (ya limitada a `settings.MAX_LLM_INPUT_TOKENS`) por cada llamada. La
+    memoria se estima con el tokenizador de BERTScore como el pico de un par: embeddings de ambos
+    textos más la matriz de similitud entre sus tokens.
+
+    Parameters
+    ----------
+    answers : list of str
+        Respuestas a evaluar.
+    references : list of str
+        Respuesta de referencia de cada respuesta.
+    prompts : list of str
+        Texto fijo del prompt (instrucción y rúbrica) de cada respuesta.
+    judges : list of str
+        Jueces LLM que reciben cada respuesta ("openai" y/o "prometheus").
+
+    Returns
+    -------
+    dict
+        Decisión tomada ("accepted") junto con las estimaciones (total y por juez) y los presupuestos aplicados.
+
+    Raises
+    ------
+    HTTPException
+        Con código 413 y la misma información (con decisión "rejected") si se supera algún presupuesto.
+    """
+    # Las referencias y prompts se repiten entre respuestas: cada texto se tokeniza una vez por juez
+    counts = {}
+
+    def count(text, judge):
+        if (text, judge) not in counts:
+            counts[(text, judge)] = count_tokens(text, judge)
+        return counts[(text, judge)]
+
+    tokens_by_judge = {judge: 0 for judge in judges}
+    peak_memory_bytes = 0
+    for answer, reference, prompt in zip(answers, references, prompts):
+        for judge in judges:
+            tokens_by_judge[judge] += (
+                count(prompt, judge)
+                + count(reference, judge)
+                + min(count(answer, judge), settings.MAX_LLM_INPUT_TOKENS)
+            )
+        answer_tokens = count(answer, "bertscore")
+        reference_tokens = count(reference, "bertscore")
+        pair_bytes = 4 * (
+            (answer_tokens + reference_tokens) * _BERTSCORE_HIDDEN_SIZE
+            + answer_tokens * reference_tokens
+        )
+        peak_memory_bytes = max(peak_memory_bytes, pair_bytes)
+
+    llm_tokens = sum(tokens_by_judge.values())
+    decision = {
+        "decision": "accepted",
+        "estimated_llm_tokens": llm_tokens,
+        "estimated_tokens_by_judge": tokens_by_judge,
+        "token_budget": settings.REQUEST_TOKEN_BUDGET,
+        "estimated_bertscore_memory_mb": round(peak_memory_bytes / 2**20, 2),
+        "memory_budget_mb": settings.REQUEST_MEMORY_BUDGET_MB,
+    }
+    if (
+        settings.REQUEST_TOKEN_BUDGET is not None
+        and llm_tokens > settings.REQUEST_TOKEN_BUDGET
+    ) or (
+        settings.REQUEST_MEMORY_BUDGET_MB is not None
+        and decision["estimated_bertscore_memory_mb"]
+        > settings.REQUEST_MEMORY_BUDGET_MB
+    ):
+        decision["decision"] = "rejected"
+        raise HTTPException(status_code=413, detail=decision)
+    return decision
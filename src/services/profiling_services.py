@@ -0,0 +1,162 @@
+import hmac
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException
+from ..config.settings import settings
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+# pyinstrument es opcional: sin él solo se reportan los tiempos por etapa
+except ImportError:
+    Profiler = None
+
+# Tiempos por etapa de la petición en curso; None cuando el perfilado no está activo
+_stage_timings: ContextVar = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def profile_stage(name: str):
+    """
+    Acumula el tiempo de una etapa de evaluación si la petición actual se está perfilando.
+
+    Cuando el perfilado no está activo solo se consulta una variable de contexto, por lo que
+    puede dejarse en el código de evaluación sin coste apreciable.
+
+    Parameters
+    ----------
+    name : str
+        Nombre de la etapa (por ejemplo "prometheus" o "bertscore").
+    """
+    timings = _stage_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage = timings.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += time.perf_counter() - start
+        stage["calls"] += 1
+
+
+class ProfileReport:
+    """
+    Resultado del perfilado de una petición. Si el perfilado no se pidió, `headers` queda vacío.
+    """
+
+    def __init__(self):
+        self.profile_id = None
+        self.stages = {}
+        self.headers = {}
+
+
+def check_profiling_token(token: str):
+    """
+    Verifica el token de perfilado. El perfilado queda deshabilitado si `settings.PROFILING_TOKEN` no está definido.
+
+    Raises
+    ------
+    HTTPException
+        Con código 403 si el token no es válido.
+    """
+    if (
+        not settings.PROFILING_TOKEN
+        or token is None
+        or not hmac.compare_digest(token, settings.PROFILING_TOKEN)
+    ):
+        raise HTTPException(status_code=403, detail="Token de perfilado no válido.")
+
+
+@contextmanager
+def request_profiler(token: str = None):
+    """
+    Perfila el bloque envuelto cuando la petición trae un token de perfilado válido.
+
+    Con un token válido se ejecuta el bloque bajo el profiler de muestreo de pyinstrument
+    (si está instalado), se guarda el perfil en formato speedscope en `settings.PROFILES_DIR`
+    (conservando solo los `settings.PROFILES_MAX_FILES` más recientes) y se registran los tiempos
+    de cada `profile_stage`. Si pyinstrument no está instalado la respuesta lleva el encabezado
+    `X-Profile-Sampler: unavailable` en lugar de `X-Profile-Id`. Sin token no se hace nada.
+
+    Parameters
+    ----------
+    token : str, optional
+        Valor del encabezado `X-Profile-Token` de la petición.
+
+    Yields
+    ------
+    ProfileReport
+        Al salir del bloque contiene el id del perfil, los tiempos por etapa y los encabezados
+        `X-Profile-Id` y `X-Profile-Stages` que se deben añadir a la respuesta.
+
+    Raises
+    ------
+    HTTPException
+        Con código 403 si el token no coincide con `settings.PROFILING_TOKEN`.
+    """
+    report = ProfileReport()
+    if token is None:
+        yield report
+        return
+
+    check_profiling_token(token)
+    report.profile_id = uuid.uuid4().hex
+    stage_token = _stage_timings.set(report.stages)
+    profiler = Profiler(interval=0.001) if Profiler is not None else None
+    if profiler is not None:
+        profiler.start()
+    else:
+        print("pyinstrument no está instalado: solo se reportan los tiempos por etapa")
+    try:
+        yield report
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _stage_timings.reset(stage_token)
+
+        report.headers["X-Profile-Stages"] = json.dumps(
+            report.stages, separators=(",", ":")
+        )
+        if profiler is not None:
+            os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+            with open(profile_path(report.profile_id), "w") as f:
+                f.write(profiler.output(renderer=SpeedscopeRenderer()))
+            _prune_profiles()
+            report.headers["X-Profile-Id"] = report.profile_id
+        else:
+            report.headers["X-Profile-Sampler"] = "unavailable"
+
+
+def _prune_profiles():
+    """
+    Borra los perfiles más antiguos de `settings.PROFILES_DIR` hasta dejar `settings.PROFILES_MAX_FILES`.
+    """
+    # Otra petición concurrente puede borrar un perfil entre el listado y su uso
+    profiles = []
+    for name in os.listdir(settings.PROFILES_DIR):
+        if not name.endswith(".speedscope.json"):
+            continue
+        path = os.path.join(settings.PROFILES_DIR, name)
+        try:
+            profiles.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            continue
+    profiles.sort()
+    for _, path in profiles[: max(0, len(profiles) - settings.PROFILES_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def profile_path(profile_id: str) -> str:
+    """
+    Retorna la ruta del perfil speedscope guardado para `profile_id`.
+    """
+    return os.path.join(settings.PROFILES_DIR, f"{profile_id}.speedscope.json")
@@ -1,12 +1,27 @@
+import os
+import threading
+import zipfile
+import multiprocessing
 import pandas as pd
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import HTTPException
-from ..schemas.teacher_evaluation_schemas import TeacherEvaluationRequest
+from ..config.settings import settings
+from ..schemas.teacher_evaluation_schemas import (
+    TeacherEvaluationRequest,
+    BulkTeacherEvaluationRequest,
+)
 from .evaluation_services import (
     evaluate_with_openai,
     evaluate_with_bertscore,
     evaluate_prometheus,
+    evaluate_student_with_openai,
 )
+from .answer_clustering_services import cluster_answers
+from .teacher_sheet_services import read_teacher_sheet, parse_teacher_sheet_bytes
+from .profiling_services import profile_stage
+from .length_services import fit_llm_input, check_request_budget
 
 
 def process_teacher_evaluation(
@@ -32,54 +47,257 @@ def process_teacher_evaluation(
         A BytesIO object containing the output Excel file with, for each student:
         - Evaluation per question (score and feedback).
         - Final grade.
+        - Grading mode and judge. With `packed_grading` every student is graded by OpenAI in a single
+          structured call ('packed'); if a student's call fails, only that student's questions are graded
+          one by one with the same OpenAI judge and schema ('per_question'). Without it every question
+          is graded by Prometheus ('per_question'). All grades in a workbook come from the same judge.
+        - Near-duplicate cluster id per question, when `near_duplicate_threshold` is set. Students sharing
+          a cluster id received the LLM evaluation of the cluster representative (its first student) for
+          that question, in both grading modes: in packed mode each student's call only includes the
+          questions not already covered by a representative. BERTScore is still computed for every student.
+        - Length action per question ('truncated' or 'summarized') for answers that exceeded the LLM judge limit.
+        A second 'length_budget' worksheet records the token and memory budget decision for the request.
+
+    Raises
+    ------
+    HTTPException
+        With status 413 if the sheet exceeds the configured token or memory budget.
     """
-    try:
-        df = pd.read_excel(file_stream)
-    except Exception as e:
-        raise HTTPException(
-            status_code=400, detail=f"Error al leer el archivo Excel: {e}"
-        )
+    num_questions = len(eval_req.reference_responses)
+    with profile_stage("read_excel"):
+        df = read_teacher_sheet(file_stream, num_questions)
+    budget = check_teacher_sheet_budget(df, eval_req)
+    results = grade_teacher_sheet(df, eval_req)
+    with profile_stage("write_excel"):
+        return write_teacher_results(results, eval_req, budget)
 
-    # Verificamos que exista la columna del nombre del estudiante
-    if "student_name" not in df.columns:
-        raise HTTPException(
-            status_code=400,
-            detail="El archivo debe contener una columna 'student_name'.",
-        )
 
+def _sheet_judges(eval_req: TeacherEvaluationRequest) -> tuple:
+    """
+    Returns every LLM judge a sheet can call, including its per-question fallback. With packed
+    grading the fallback uses the same OpenAI judge, so both the budget and the answer length
+    limits only need its tokenizer.
+    """
+    return ("openai",) if eval_req.packed_grading else ("prometheus",)
+
+
+def check_teacher_sheet_budget(
+    df: pd.DataFrame, eval_req: TeacherEvaluationRequest
+) -> dict:
+    """
+    Applies `check_request_budget` to every (student, question) cell of a validated sheet.
+
+    Each cell is counted as its own call (prompt, reference and answer) for every judge in
+    `_sheet_judges`. That is the cost of the per-question fallback, so a sheet whose packed calls
+    fail is still within the budget it was accepted with.
+    """
+    num_questions = len(eval_req.reference_responses)
+    rubric_text = " ".join(eval_req.rubric.values())
+    answers, references, prompts = [], [], []
+    for q in range(num_questions):
+        column = df.iloc[:, q + 1].tolist()
+        answers.extend(column)
+        references.extend([eval_req.reference_responses[q]] * len(column))
+        prompts.extend([f"{eval_req.instructions[q]} {rubric_text}"] * len(column))
+    return check_request_budget(
+        answers, references, prompts, list(_sheet_judges(eval_req))
+    )
+
+
+def grade_teacher_sheet(
+    df: pd.DataFrame, eval_req: TeacherEvaluationRequest, judge_cache: dict = None
+) -> list:
+    """
+    Grades every question of every student in a sheet already validated by `read_teacher_sheet`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with the 'student_name' column followed by one column per question.
+    eval_req : TeacherEvaluationRequest
+        The evaluation request containing reference responses, instructions, and rubric.
+    judge_cache : dict, optional
+        LLM judge results (feedback, score, length action) keyed by (judge, instruction, answer,
+        reference, rubric, long answer policy). Sharing it across sheets sends each identical cell
+        to the judge only once, in both grading modes: packed calls only include the cells not in it.
+
+    Returns
+    -------
+    list of dict
+        Per-student results with the question evaluations, final grade, grading mode and judge.
+    """
+    if judge_cache is None:
+        judge_cache = {}
     num_questions = len(eval_req.reference_responses)
-    # Se asume que las columnas siguientes a 'student_name' corresponden a las respuestas de cada pregunta
-    # y que hay exactamente num_questions columnas de respuestas
     student_answers = df.iloc[:, 1 : 1 + num_questions]
-    if student_answers.shape[1] != num_questions:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Se esperaban {num_questions} preguntas, pero se encontraron {student_answers.shape[1]} columnas de respuestas.",
+    rubric_key = tuple(sorted(eval_req.rubric.items()))
+    judge = (
+        settings.OPENAI_JUDGE_MODEL
+        if eval_req.packed_grading
+        else settings.PROMETHEUS_JUDGE_MODEL
+    )
+
+    def judge_key(student_idx, q):
+        # Celda idéntica para el mismo juez: se califica una sola vez aunque aparezca en varias hojas
+        return (
+            judge,
+            eval_req.instructions[q],
+            str(student_answers.iat[student_idx, q]),
+            eval_req.reference_responses[q],
+            rubric_key,
+            eval_req.long_answer_policy,
         )
 
+    # Agrupamiento opcional de respuestas casi duplicadas por pregunta: el juez LLM (Prometheus o la
+    # llamada empaquetada) califica solo el primer estudiante de cada grupo y el resto reutiliza su evaluación
+    cluster_ids = None
+    if eval_req.near_duplicate_threshold is not None:
+        with profile_stage("clustering"):
+            cluster_ids = [
+                cluster_answers(
+                    student_answers.iloc[:, q].tolist(),
+                    eval_req.near_duplicate_threshold,
+                )
+                for q in range(num_questions)
+            ]
+    cluster_judgements = {}
+
+    # Respuestas ajustadas al límite del juez, calculadas una sola vez por celda
+    fitted_answers = {}
+
+    def fit_answer(student_idx, q):
+        if (student_idx, q) not in fitted_answers:
+            fitted_answers[(student_idx, q)] = fit_llm_input(
+                student_answers.iat[student_idx, q],
+                eval_req.long_answer_policy,
+                _sheet_judges(eval_req),
+            )
+        return fitted_answers[(student_idx, q)]
+
+    # Calificación empaquetada: una sola llamada por estudiante con las preguntas que no cubre ya el
+    # representante de su grupo de casi duplicados ni una celda idéntica de `judge_cache`. Si la llamada
+    # de un estudiante falla, solo sus preguntas pendientes se califican una a una con el mismo juez y
+    # el mismo esquema.
+    packed_results = {}
+    grading_modes = {}
+    if eval_req.packed_grading:
+        packed_cluster_results = {}
+        for student_idx in range(len(df)):
+            grading_modes[student_idx] = "packed"
+            pending = []
+            for q in range(num_questions):
+                cluster_id = cluster_ids[q][student_idx] if cluster_ids else None
+                if (q, cluster_id) in packed_cluster_results:
+                    packed_results[(student_idx, q)] = packed_cluster_results[
+                        (q, cluster_id)
+                    ]
+                elif judge_key(student_idx, q) in judge_cache:
+                    packed_results[(student_idx, q)] = judge_cache[
+                        judge_key(student_idx, q)
+                    ]
+                    if cluster_ids:
+                        packed_cluster_results[(q, cluster_id)] = packed_results[
+                            (student_idx, q)
+                        ]
+                else:
+                    pending.append(q)
+            if not pending:
+                continue
+
+            packed_inputs = [fit_answer(student_idx, q) for q in pending]
+            with profile_stage("packed_judge"):
+                packed_evaluation = evaluate_student_with_openai(
+                    [eval_req.instructions[q] for q in pending],
+                    [judged_answer for judged_answer, _ in packed_inputs],
+                    [eval_req.reference_responses[q] for q in pending],
+                    eval_req.rubric,
+                )
+            if packed_evaluation is not None:
+                q_evals = packed_evaluation.evaluations
+            else:
+                grading_modes[student_idx] = "per_question"
+                q_evals = []
+                for q, (judged_answer, _) in zip(pending, packed_inputs):
+                    with profile_stage("openai"):
+                        single_evaluation = evaluate_student_with_openai(
+                            [eval_req.instructions[q]],
+                            [judged_answer],
+                            [eval_req.reference_responses[q]],
+                            eval_req.rubric,
+                        )
+                    q_evals.append(
+                        single_evaluation.evaluations[0] if single_evaluation else None
+                    )
+
+            for q, q_eval, (_, length_action) in zip(pending, q_evals, packed_inputs):
+                if q_eval is None:
+                    # Mismo valor por defecto que `evaluate_prometheus`; no se reutiliza en el grupo
+                    packed_results[(student_idx, q)] = (
+                        "Error en evaluación OpenAI",
+                        0.0,
+                        length_action,
+                    )
+                    continue
+                packed_results[(student_idx, q)] = (
+                    q_eval.feedback,
+                    q_eval.score,
+                    length_action,
+                )
+                judge_cache[judge_key(student_idx, q)] = packed_results[
+                    (student_idx, q)
+                ]
+                if cluster_ids:
+                    packed_cluster_results[(q, cluster_ids[q][student_idx])] = (
+                        packed_results[(student_idx, q)]
+                    )
+
     # Listas para resultados por estudiante
     results = []
 
     # Iteramos por cada fila (estudiante)
-    for index, row in df.iterrows():
+    for student_idx, (index, row) in enumerate(df.iterrows()):
         student_name = row["student_name"]
+        answers = [row.iloc[q + 1] for q in range(num_questions)]
         question_evaluations = []
         final_scores = []
 
         # Iteramos por cada pregunta (columna)
         for q in range(num_questions):
-            student_answer = row.iloc[
-                q + 1
-            ]  # asumiendo que las respuestas están en orden
+            student_answer = answers[q]  # asumiendo que las respuestas están en orden
             reference = eval_req.reference_responses[q]
             instruction = eval_req.instructions[q]
-            # Prometheus y BERTScore
-            prometheus_feedback, prometheus_score = evaluate_prometheus(
-                instruction, student_answer, reference, eval_req.rubric
-            )
-            bertscore = evaluate_with_bertscore([student_answer], [reference])
+            cluster_id = cluster_ids[q][student_idx] if cluster_ids else None
+            with profile_stage("bertscore"):
+                bertscore = evaluate_with_bertscore([student_answer], [reference])
+
+            if eval_req.packed_grading:
+                feedback, judge_score, length_action = packed_results[(student_idx, q)]
+            else:
+                # Prometheus, una vez por grupo de respuestas casi duplicadas y por celda idéntica.
+                # Las respuestas demasiado largas se recortan o resumen antes de enviarse al juez.
+                cell_key = judge_key(student_idx, q)
+                if (q, cluster_id) in cluster_judgements:
+                    feedback, judge_score, length_action = cluster_judgements[
+                        (q, cluster_id)
+                    ]
+                else:
+                    if cell_key not in judge_cache:
+                        judged_answer, length_action = fit_answer(student_idx, q)
+                        with profile_stage("prometheus"):
+                            judge_cache[cell_key] = (
+                                *evaluate_prometheus(
+                                    instruction,
+                                    judged_answer,
+                                    reference,
+                                    eval_req.rubric,
+                                ),
+                                length_action,
+                            )
+                    feedback, judge_score, length_action = judge_cache[cell_key]
+                    if cluster_id is not None:
+                        cluster_judgements[(q, cluster_id)] = judge_cache[cell_key]
 
-            q_score = prometheus_score
+            q_score = judge_score
 
             final_scores.append(q_score)
 
@@ -88,9 +306,11 @@ def process_teacher_evaluation(
                     "question": f"Q{q+1}",
                     "student_answer": student_answer,
                     "bertscore": bertscore,
-                    "prometheus_feedback": prometheus_feedback,
-                    "prometheus_score": prometheus_score,
+                    "feedback": feedback,
+                    "judge_score": judge_score,
                     "final_question_score": q_score,
+                    "cluster_id": cluster_id,
+                    "length_action": length_action,
                 }
             )
 
@@ -102,18 +322,41 @@ def process_teacher_evaluation(
                 "student_name": student_name,
                 "questions": question_evaluations,
                 "final_grade": final_grade,
+                "grading_mode": grading_modes.get(student_idx, "per_question"),
+                "judge": judge,
             }
         )
 
+    return results
+
+
+def write_teacher_results(
+    results: list, eval_req: TeacherEvaluationRequest, budget: dict = None
+) -> BytesIO:
+    """
+    Exports the results of `grade_teacher_sheet` to an Excel file with one row per student.
+
+    If `budget` is given, the decision of `check_request_budget` is written to a second
+    'length_budget' worksheet.
+    """
     # Convertir los resultados a un DataFrame para exportar a Excel
     # Para simplificar, aplanamos la estructura: una fila por estudiante con columnas para cada pregunta y la nota final.
     output_rows = []
     for res in results:
-        row = {"student_name": res["student_name"], "final_grade": res["final_grade"]}
+        row = {
+            "student_name": res["student_name"],
+            "final_grade": res["final_grade"],
+            "grading_mode": res["grading_mode"],
+            "judge": res["judge"],
+        }
         for q_eval in res["questions"]:
             q = q_eval["question"]
             row[f"{q} final_score"] = q_eval["final_question_score"]
-            row[f"{q} prometheus_feedback"] = q_eval["prometheus_feedback"]
+            if eval_req.near_duplicate_threshold is not None:
+                row[f"{q} cluster_id"] = q_eval["cluster_id"]
+            row[f"{q} feedback"] = q_eval["feedback"]
+            if q_eval["length_action"] != "none":
+                row[f"{q} length_action"] = q_eval["length_action"]
             # Puedes incluir más columnas si lo deseas, por ejemplo openai_evaluation, bertscore, cost, etc.
         output_rows.append(row)
 
@@ -121,5 +364,203 @@ def process_teacher_evaluation(
     output = BytesIO()
     with pd.ExcelWriter(output, engine="openpyxl") as writer:
         output_df.to_excel(writer, index=False)
+        if budget is not None:
+            pd.DataFrame([budget]).to_excel(
+                writer, sheet_name="length_budget", index=False
+            )
+    output.seek(0)
+    return output
+
+
+_sheet_pool = None
+_sheet_pool_lock = threading.Lock()
+
+
+def _get_sheet_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool shared by every bulk request to parse sheets, creating it on first use.
+
+    Workers are started with 'spawn': the API process already runs several threads and has torch
+    loaded, and forking a multithreaded process can deadlock the child. Spawned workers only import
+    `teacher_sheet_services`, so they do not load the judges.
+    """
+    global _sheet_pool
+    with _sheet_pool_lock:
+        if _sheet_pool is None:
+            _sheet_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _sheet_pool
+
+
+def _discard_sheet_pool(executor: ProcessPoolExecutor):
+    """
+    Drops a broken pool (e.g. a worker killed by the OOM killer) so the next request creates a new one.
+    """
+    global _sheet_pool
+    with _sheet_pool_lock:
+        if _sheet_pool is executor:
+            _sheet_pool = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def process_bulk_teacher_evaluation(
+    zip_stream, bulk_req: BulkTeacherEvaluationRequest
+) -> BytesIO:
+    """
+    Processes a zip of teacher Excel sheets in a single run.
+
+    Sheets are parsed and validated in parallel in a process pool. Grading then goes through
+    `grade_teacher_sheet` with one judge cache shared by all sheets, so identical
+    (instruction, answer, reference, rubric) cells are sent to each judge only once, whether it is
+    Prometheus or a packed OpenAI call.
+
+    Parameters
+    ----------
+    zip_stream : BytesIO
+        Zip file containing one Excel sheet (.xlsx or .xls) per exam.
+    bulk_req : BulkTeacherEvaluationRequest
+        Evaluation parameters per sheet (by file name inside the zip) and/or shared by all sheets.
+
+    Returns
+    -------
+    BytesIO
+        A zip file with one '<sheet>_evaluation.xlsx' workbook per sheet graded successfully (with a
+        numeric suffix if two sheets map to the same name) and a 'summary.xlsx' workbook with one row
+        per student (sheet, output file, student, final grade, grading mode, judge)
+        plus one row per sheet that could not be processed (invalid sheet, missing parameters, a
+        parsing worker that died or over the token/memory budget), with its error.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_stream)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(
+            status_code=400, detail=f"Error al leer el archivo zip: {e}"
+        )
+
+    sheet_names = [
+        name
+        for name in archive.namelist()
+        if name.lower().endswith((".xlsx", ".xls"))
+        and not name.startswith("__MACOSX/")
+        and not os.path.basename(name).startswith("~$")
+    ]
+    if not sheet_names:
+        raise HTTPException(
+            status_code=400,
+            detail="El archivo zip no contiene hojas de Excel (.xlsx o .xls).",
+        )
+
+    summary_rows = []
+    sheet_requests = {}
+    for name in sheet_names:
+        eval_req = (
+            bulk_req.per_sheet.get(name)
+            or bulk_req.per_sheet.get(os.path.basename(name))
+            or bulk_req.shared
+        )
+        if eval_req is None:
+            summary_rows.append(
+                {
+                    "sheet": name,
+                    "error": "No se definieron parámetros de evaluación para esta hoja.",
+                }
+            )
+            continue
+        sheet_requests[name] = eval_req
+
+    # Lectura y validación de las hojas en paralelo
+    parsed_sheets = {}
+    if sheet_requests:
+        with profile_stage("read_excel"):
+            executor = _get_sheet_pool()
+            futures = {}
+            for name, eval_req in sheet_requests.items():
+                try:
+                    futures[name] = executor.submit(
+                        parse_teacher_sheet_bytes,
+                        name,
+                        archive.read(name),
+                        len(eval_req.reference_responses),
+                    )
+                except BrokenProcessPool:
+                    futures[name] = None
+            pool_broken = False
+            for name, future in futures.items():
+                try:
+                    if future is None:
+                        raise BrokenProcessPool()
+                    name, df, error = future.result()
+                except BrokenProcessPool:
+                    # Un worker murió (p. ej. sin memoria): se descarta el pool y las hojas
+                    # afectadas se reportan en el resumen sin bloquear las peticiones siguientes
+                    pool_broken = True
+                    error = (
+                        "El proceso que leía la hoja terminó inesperadamente "
+                        "(posiblemente por falta de memoria)."
+                    )
+                if error is not None:
+                    summary_rows.append({"sheet": name, "error": error})
+                else:
+                    parsed_sheets[name] = df
+            if pool_broken:
+                _discard_sheet_pool(executor)
+
+    # Calificación con una caché de juez compartida entre todas las hojas
+    judge_cache = {}
+    output_names = set()
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as output_zip:
+        for name, df in parsed_sheets.items():
+            eval_req = sheet_requests[name]
+            try:
+                budget = check_teacher_sheet_budget(df, eval_req)
+            except HTTPException as e:
+                summary_rows.append({"sheet": name, "error": str(e.detail)})
+                continue
+            results = grade_teacher_sheet(df, eval_req, judge_cache)
+            # Nombre de salida único: 'x.xls' y 'x.xlsx' o 'a/b.xlsx' y 'a_b.xlsx' no deben pisarse
+            stem = os.path.splitext(name)[0].replace("/", "_")
+            output_name = f"{stem}_evaluation.xlsx"
+            suffix = 2
+            while output_name in output_names:
+                output_name = f"{stem}_evaluation_{suffix}.xlsx"
+                suffix += 1
+            output_names.add(output_name)
+            with profile_stage("write_excel"):
+                output_zip.writestr(
+                    output_name,
+                    write_teacher_results(results, eval_req, budget).getvalue(),
+                )
+            for res in results:
+                summary_rows.append(
+                    {
+                        "sheet": name,
+                        "output_file": output_name,
+                        "student_name": res["student_name"],
+                        "final_grade": res["final_grade"],
+                        "grading_mode": res["grading_mode"],
+                        "judge": res["judge"],
+                    }
+                )
+
+        summary_df = pd.DataFrame(
+            summary_rows,
+            columns=[
+                "sheet",
+                "output_file",
+                "student_name",
+                "final_grade",
+                "grading_mode",
+                "judge",
+                "error",
+            ],
+        )
+        summary = BytesIO()
+        with pd.ExcelWriter(summary, engine="openpyxl") as writer:
+            summary_df.to_excel(writer, index=False)
+        output_zip.writestr("summary.xlsx", summary.getvalue())
+
     output.seek(0)
     return output
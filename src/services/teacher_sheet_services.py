@@ -0,0 +1,74 @@
+import pandas as pd
+from io import BytesIO
+from fastapi import HTTPException
+
+
+def read_teacher_sheet(file_stream, num_questions: int) -> pd.DataFrame:
+    """
+    Reads and validates the Excel file containing student responses.
+
+    The file must have a first column 'student_name' followed by exactly `num_questions`
+    answer columns, in the same order as the questions.
+
+    Parameters
+    ----------
+    file_stream : BytesIO
+        The input Excel file stream containing student responses.
+    num_questions : int
+        Expected number of questions.
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the 'student_name' column and the answer columns.
+
+    Raises
+    ------
+    HTTPException
+        With status 400 if the file cannot be read or does not have the expected structure.
+    """
+    try:
+        df = pd.read_excel(file_stream)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400, detail=f"Error al leer el archivo Excel: {e}"
+        )
+
+    # Verificamos que exista la columna del nombre del estudiante
+    if "student_name" not in df.columns:
+        raise HTTPException(
+            status_code=400,
+            detail="El archivo debe contener una columna 'student_name'.",
+        )
+
+    # Se asume que las columnas siguientes a 'student_name' corresponden a las respuestas de cada pregunta
+    # y que hay exactamente num_questions columnas de respuestas
+    student_answers = df.iloc[:, 1 : 1 + num_questions]
+    if student_answers.shape[1] != num_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Se esperaban {num_questions} preguntas, pero se encontraron {student_answers.shape[1]} columnas de respuestas.",
+        )
+
+    return df
+
+
+def parse_teacher_sheet_bytes(
+    sheet_name: str, content: bytes, num_questions: int
+) -> tuple:
+    """
+    Variant of `read_teacher_sheet` meant to run in a process pool.
+
+    This module does not import the evaluation services, so workers started with 'spawn'
+    (see `_get_sheet_pool`) do not load the judges. Errors are returned as text because HTTP exceptions are not reliably
+    picklable across processes.
+
+    Returns
+    -------
+    tuple
+        (sheet_name, DataFrame or None, error message or None)
+    """
+    try:
+        return sheet_name, read_teacher_sheet(BytesIO(content), num_questions), None
+    except HTTPException as e:
+        return sheet_name, None, e.detail